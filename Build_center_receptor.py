@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 # Build_center_receptor.py
+import csv
 import json
-import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 import numpy as np
-from pandas.errors import EmptyDataError
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is used instead
+    orjson = None
 
 # ---------- config ----------
 BASE_DIR = Path(".").resolve()
@@ -17,30 +23,27 @@ OUTPUT_JSON = BASE_DIR / "Center_boxes.json"
 PAD = 3.0
 MIN_SIZE = 16.0
 FORCE_CUBE = True
+CHUNK_ROWS = 200_000                      # contact rows parsed per read_csv chunk
+MAX_WORKERS = None                        # processes reducing CSVs in parallel (None: one per core, capped at 61 on Windows)
 # ----------------------------
 
-def parse_coord(val):
-    """Accept '(x, y, z)' strings or tuples/lists; return (x, y, z) floats."""
-    if val is None or (isinstance(val, float) and math.isnan(val)):
-        raise ValueError("coord is NaN/None")
-
-    if isinstance(val, (tuple, list)) and len(val) == 3:
-        x, y, z = val
-        return float(x), float(y), float(z)
-
-    if not isinstance(val, str):
-        raise ValueError(f"not a string/tuple/list coord: {val!r}")
-
-    v = val.strip()
-    if (v.startswith("(") and v.endswith(")")) or (v.startswith("[") and v.endswith("]")):
-        v = v[1:-1]
+def parse_coords(ser: pd.Series) -> np.ndarray:
+    """Vectorized parse of '(x, y, z)' / '[x, y, z]' strings; return (N, 3) floats, malformed rows dropped."""
+    ser = ser.dropna().astype(str).str.strip()
+    ser = ser.str.replace(r"^[\(\[]|[\)\]]$", "", regex=True)
+    parts = ser.str.split(",", expand=True)
+    if parts.shape[1] < 3:
+        return np.empty((0, 3), dtype=np.float64)
 
-    parts = [p.strip() for p in v.split(",")]
-    if len(parts) != 3:
-        raise ValueError(f"cannot parse coord: {val!r}")
+    # rows with more than three fields are malformed
+    if parts.shape[1] > 3:
+        parts = parts[parts.iloc[:, 3:].isna().all(axis=1)]
+    arr = parts.iloc[:, :3].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    return arr[np.isfinite(arr).all(axis=1)]
 
-    x, y, z = (float(p) for p in parts)
-    return x, y, z
+def _bbox_stats(arr):
+    """(center, min, max) of an (N, 3) array as single NumPy reductions."""
+    return arr.sum(axis=0) / arr.shape[0], np.minimum.reduce(arr), np.maximum.reduce(arr)
 
 def process_csv(csv_path: Path):
     """Return dict with center/size/n_points from one CSV, or None if invalid/empty."""
@@ -53,62 +56,74 @@ def process_csv(csv_path: Path):
         print(f"[warn] missing file: {csv_path}")
         return None
 
-    # safe read
-    try:
-        df = pd.read_csv(csv_path)
-    except EmptyDataError:
-        print(f"[warn] {csv_path.name}: EmptyDataError (no columns), skipping")
-        return None
+    # safe read: peek at the header with the csv module, the coord column is loaded below
+    with csv_path.open(newline="", encoding="utf-8-sig") as f:
+        columns = next((row for row in csv.reader(f) if row), None)
 
-    if df is None or df.shape[1] == 0:
-        print(f"[warn] {csv_path.name}: no columns after read, skipping")
+    if not columns:
+        print(f"[warn] {csv_path.name}: no header row (no columns), skipping")
         return None
 
     # Accept either column name; contact script emits 'prot_coord'
     coord_col = None
     for candidate in ("prot_coord", "protein_coord"):
-        if candidate in df.columns:
+        if candidate in columns:
             coord_col = candidate
             break
     if coord_col is None:
         print(f"[warn] {csv_path.name}: no prot_coord/protein_coord column, skipping")
         return None
 
-    # extract coords
-    coords = []
-    for val in df[coord_col]:
-        try:
-            coords.append(parse_coord(val))
-        except Exception:
-            # ignore malformed rows
-            continue
-
-    if not coords:
+    # stream the column in chunks; only the compact integer dedup keys are kept
+    # (keys are coords rounded to 3 decimals, as integer thousandths)
+    chunk_keys = []
+    reader = pd.read_csv(csv_path, usecols=[coord_col], dtype={coord_col: "string"},
+                         engine="c", chunksize=CHUNK_ROWS)
+    for chunk in reader:
+        coords = parse_coords(chunk[coord_col])  # malformed rows are dropped
+        if len(coords):
+            chunk_keys.append(np.unique(np.round(coords * 1000).astype(np.int64), axis=0))
+
+    if not chunk_keys:
         print(f"[warn] {csv_path.name}: no valid coords, skipping")
         return None
 
-    # Deduplicate identical protein-atom coords to avoid overweighting
-    coords = list({(round(x, 3), round(y, 3), round(z, 3)) for x, y, z in coords})
-    arr = np.array(coords, dtype=float)  # (N, 3)
-
-    center = arr.mean(axis=0)
-    minc = arr.min(axis=0)
-    maxc = arr.max(axis=0)
-    size = (maxc - minc) + 2 * PAD
-    size = np.maximum(size, MIN_SIZE)
+    # Deduplicate identical protein-atom coords (across chunks) to avoid overweighting
+    keys = np.unique(np.concatenate(chunk_keys), axis=0)
+    arr = keys / 1000.0  # (N, 3)
 
+    center, minc, maxc = _bbox_stats(arr)
     if FORCE_CUBE:
-        m = float(size.max())
-        size = np.array([m, m, m], dtype=float)
+        # cube edge: widest padded extent, floored at MIN_SIZE (plain scalars, no arrays)
+        m = max(float((maxc - minc).max()) + 2 * PAD, MIN_SIZE)
+        size = [m, m, m]
+    else:
+        size = np.maximum((maxc - minc) + 2 * PAD, MIN_SIZE).tolist()
 
     return {
         "center": [float(center[0]), float(center[1]), float(center[2])],
-        "size":   [float(size[0]),   float(size[1]),   float(size[2])],
+        "size":   size,
         "n_points": int(arr.shape[0]),
     }
 
+def _json_member(key, data):
+    """'  "key": {...}' as it appears inside the indent=2 output object."""
+    if orjson is not None:
+        blob = orjson.dumps({key: data}, option=orjson.OPT_INDENT_2).decode()
+    else:
+        blob = json.dumps({key: data}, indent=2)
+    return blob[2:-2]
+
+def _csv_exists(csv_path: Path, csv_names: set) -> bool:
+    # exact hit in the listing, else exists(): matches case-insensitively on Windows/macOS like before
+    return csv_path.name in csv_names or csv_path.exists()
+
 def main():
-    results = {}
+    n_entries = 0
+    jobs = []
+
+    # list CSV_DIR once instead of stat-ing every candidate name
+    csv_names = {e.name for e in os.scandir(CSV_DIR)} if CSV_DIR.is_dir() else set()
 
     # loop over PDBs so JSON keys match docking names
     for pdb_path in sorted(PDB_DIR.glob("*.pdb")):
@@ -116,27 +131,37 @@ def main():
 
         # primary CSV name
         csv_path = CSV_DIR / f"{pdb_stem}.csv"
-        if not csv_path.exists():
+        if not _csv_exists(csv_path, csv_names):
             # try alternate naming with/without _malaria
             alt = pdb_stem.removesuffix("_malaria") if pdb_stem.endswith("_malaria") else f"{pdb_stem}_malaria"
             alt_csv = CSV_DIR / f"{alt}.csv"
-            if alt_csv.exists():
+            if _csv_exists(alt_csv, csv_names):
                 csv_path = alt_csv
             else:
                 print(f"[warn] CSV for {pdb_stem} not found (tried {csv_path.name}, {alt_csv.name})")
                 continue
 
-        data = process_csv(csv_path)
-        if data is None:
-            continue
-
-        results[pdb_stem] = data
-        print(f"[ok] {pdb_stem}: center={data['center']} size={data['size']} (N={data['n_points']})")
+        jobs.append((pdb_stem, csv_path))
+
+    # CSVs are independent: reduce them in a process pool, collect on the main process.
+    # Each entry is written out as soon as it arrives (same indent=2 layout as json.dump),
+    # into a temp file that replaces OUTPUT_JSON only once complete.
+    tmp_json = OUTPUT_JSON.with_name(OUTPUT_JSON.name + ".tmp")
+    with tmp_json.open("w") as out, ProcessPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        out.write("{")
+        stems = [stem for stem, _ in jobs]
+        paths = [path for _, path in jobs]
+        for pdb_stem, data in zip(stems, ex.map(process_csv, paths, chunksize=4)):
+            if data is None:
+                continue
 
-    with OUTPUT_JSON.open("w") as f:
-        json.dump(results, f, indent=2)
+            out.write(("\n" if n_entries == 0 else ",\n") + _json_member(pdb_stem, data))
+            n_entries += 1
+            print(f"[ok] {pdb_stem}: center={data['center']} size={data['size']} (N={data['n_points']})")
+        out.write("\n}" if n_entries else "}")
+    os.replace(tmp_json, OUTPUT_JSON)
 
-    print(f"\nDone. Wrote {OUTPUT_JSON} with {len(results)} entries.")
+    print(f"\nDone. Wrote {OUTPUT_JSON} with {n_entries} entries.")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,11 @@
 import os
+import re
+import csv
+import mmap
 import subprocess
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice
 import numpy as np
 import json
 from pathlib import Path
@@ -15,6 +20,10 @@ SELECTED_LIGAND_STEMS = [
 vina_executable = r"C:\Program Files (x86)\PyRx\vina.exe"  # on Windows
 #vina_executable = r"/usr/local/bin/vina"  # on Mac
 
+VINA_CPU_PER_JOB = 2  # --cpu given to each Vina run
+MAX_WORKERS = max(1, (os.cpu_count() or 1) // VINA_CPU_PER_JOB)  # concurrent Vina runs
+PRINT_VINA_LOG = False  # echo each finished Vina log to the console (it is always saved under results/)
+
 base_dir = Path(__file__).resolve().parent
 lig_folder = base_dir / "ligand_pdbqt"   
 prot_folder = base_dir / "malaria_pdbqt"
@@ -33,41 +42,71 @@ else:
     BINDING_CENTERS = {}
     print("[info] binding_centers.json not found, will use receptor-based auto box.")
 
+# (center, size) tuples built once per receptor stem
+BOX_CACHE = {k: (tuple(v["center"]), tuple(v["size"])) for k, v in BINDING_CENTERS.items()}
+AUTO_BOX_SIZE = (25.0, 25.0, 25.0)
+
+_ATOM_RECORD_RE = re.compile(rb"^(?:ATOM|HETATM)[^\r\n]*", re.M)
+
+def _read_atom_records(pdbqt_path: Path):
+    """ATOM/HETATM lines of a PDBQT as bytes, scanned straight off an mmap of the file."""
+    with open(pdbqt_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _ATOM_RECORD_RE.findall(mm)
+
+def _heavy_atom_coords(records):
+    """
+    Fixed-width coords of ATOM/HETATM byte records as an (N, 3) float array.
+    Hydrogens and rows with malformed coordinate fields are dropped.
+    """
+    if not records:
+        return np.empty((0, 3))
+    cols = np.array(records, dtype="S80").view(np.uint8).reshape(len(records), 80)
+    # hydrogen = first non-blank byte of the atom name (cols 12-16) is 'H'; pure array masks
+    names = cols[:, 12:16]
+    first = np.argmax((names != ord(" ")) & (names != ord("\t")), axis=1)
+    heavy = names[np.arange(len(names)), first] != ord("H")
+    fields = np.ascontiguousarray(cols[heavy, 30:54]).view("S8")  # (N, 3)
+    try:
+        return fields.astype(np.float64)
+    except ValueError:
+        # rare malformed rows: convert field by field and drop the bad rows
+        coords = np.full(fields.shape, np.nan)
+        for idx, field in np.ndenumerate(fields):
+            try:
+                coords[idx] = float(field)
+            except ValueError:
+                pass
+        return coords[~np.isnan(coords).any(axis=1)]
+
+def _heavy_atom_stats(pdbqt_path: Path):
+    """(center, min, max) of the heavy-atom coords, or None if there are none."""
+    coords = _heavy_atom_coords(_read_atom_records(pdbqt_path))
+    if len(coords) == 0:
+        return None
+    return coords.mean(axis=0), coords.min(axis=0), coords.max(axis=0)
+
 def estimate_docking_box_from_pdbqt(pdbqt_path: Path, buffer: float = 5.0):
     """
     Robust center/size estimation from PDBQT via fixed-width slicing.
     Skips hydrogens. Returns (center_xyz, size_xyz).
     """
-    xs, ys, zs = [], [], []
-    with open(pdbqt_path, "r") as f:
-        for line in f:
-            if not (line.startswith("ATOM") or line.startswith("HETATM")):
-                continue
-            atom_name = line[12:16].strip()
-            if atom_name.startswith("H"):
-                continue
-            try:
-                x = float(line[30:38])
-                y = float(line[38:46])
-                z = float(line[46:54])
-                xs.append(x); ys.append(y); zs.append(z)
-            except ValueError:
-                continue
+    stats = _heavy_atom_stats(pdbqt_path)
 
-    if not xs:
+    if stats is None:
         print(f"[warn] no heavy-atom coords parsed in {pdbqt_path.name}; using (0,0,0) and 25 Å.")
         return (0.0, 0.0, 0.0), (25.0, 25.0, 25.0)
 
-    coords = np.array(list(zip(xs, ys, zs)))
-    center = coords.mean(axis=0)
-    minc = coords.min(axis=0)
-    maxc = coords.max(axis=0)
+    center, minc, maxc = stats
     size = (maxc - minc) + buffer  # numpy broadcast, then tuple-ify below
     return (tuple(center), tuple(size))
 
-def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path):
+def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path,
+             cpu: int = VINA_CPU_PER_JOB):
     """
-    Vina 1.2.x: there is NO --log flag. Capture stdout and save it as the log.
+    Vina 1.2.x: there is NO --log flag. Vina's stdout is written straight into the log file.
     """
     # Make sure the directory exists for outputs
     log_path.parent.mkdir(parents=True, exist_ok=True)
@@ -84,69 +123,61 @@ def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligan
         "--size_y", str(size[1]),
         "--size_z", str(size[2]),
         "--out", str(out_path),
-        "--cpu", "1",
+        "--cpu", str(cpu),
     ]
     pretty = " ".join(f'"{c}"' if " " in c else c for c in cmd)
     print("\n[run] AutoDock Vina:\n", pretty, "\n")
 
-    proc = subprocess.run(cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    # Save stdout to our log file
-    with open(log_path, "w") as lf:
-        lf.write(proc.stdout or "")
-    print(proc.stdout)
+    # Vina writes to the log file directly; it is only read back here if PRINT_VINA_LOG is set
+    with open(log_path, "wb") as lf:
+        proc = subprocess.run(cmd, stdout=lf, stderr=subprocess.STDOUT)
+    if PRINT_VINA_LOG:
+        print(log_path.read_text())
 
     if proc.returncode != 0:
         raise RuntimeError(f"Vina failed (exit {proc.returncode}) for {ligand.name} vs {receptor.name}. See log: {log_path}")
 
+# "<mode> <affinity> ..." rows of the Vina results table
+_AFFINITY_RE = re.compile(rb"^[ \t]*\d+[ \t]+(-?\d+(?:\.\d+)?)(?=\s|$)", re.M)
+
 def parse_affinities(log_path: Path):
     """Parse top-poses table from a Vina 1.2.x stdout log. Returns up to top-10 affinities (kcal/mol)."""
-    affinities = []
     if not log_path.exists():
-        return affinities
-    with open(log_path, "r") as f:
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
-            first = s.split()[0]
-            if first.isdigit():
-                parts = s.split()
-                if len(parts) >= 2:
-                    try:
-                        affinities.append(float(parts[1]))
-                    except ValueError:
-                        pass
-    return affinities[:10]
+        return []
+    matches = islice(_AFFINITY_RE.finditer(log_path.read_bytes()), 10)
+    return [float(m.group(1)) for m in matches]
 
 def save_affinities_csv(affinities, out_csv_path: Path):
-    df = pd.DataFrame({
-        "Rank": list(range(1, len(affinities) + 1)),
-        "Binding_Affinity_kcal/mol": affinities
-    })
     out_csv_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_csv_path, index=False)
+    with out_csv_path.open("w", newline="") as f:
+        w = csv.writer(f, lineterminator=os.linesep)  # DataFrame.to_csv default
+        w.writerow(["Rank", "Binding_Affinity_kcal/mol"])
+        w.writerows(enumerate(affinities, 1))
     print(f"[ok] saved CSV: {out_csv_path}")
 
 def build_box_for_receptor(receptor_path: Path):
     rec_base = receptor_path.stem
     # Prefer precomputed binding site boxes if key matches the receptor stem
-    if rec_base in BINDING_CENTERS:
-        data = BINDING_CENTERS[rec_base]
-        center = tuple(data["center"])
-        size   = tuple(data["size"])
-        print(f"[site-box] Using CSV-based box for {rec_base}: center={center}, size={size}")
-        return center, size
+    box = BOX_CACHE.get(rec_base)
+    if box is not None:
+        print(f"[site-box] Using CSV-based box for {rec_base}: center={box[0]}, size={box[1]}")
+        return box
     # Fallback: receptor-based automatic box
-    center, _ = estimate_docking_box_from_pdbqt(receptor_path)
-    size = (25.0, 25.0, 25.0)
-    print(f"[auto-box] Using receptor-based box for {rec_base}: center={center}, size={size}")
-    return center, size
+    box = (estimate_docking_box_from_pdbqt(receptor_path)[0], AUTO_BOX_SIZE)
+    print(f"[auto-box] Using receptor-based box for {rec_base}: center={box[0]}, size={box[1]}")
+    return box
+
+@lru_cache(maxsize=None)
+def _pdbqt_stem_map(folder: Path):
+    """{stem: path} for the .pdbqt files in folder, listed once per run with os.scandir."""
+    with os.scandir(folder) as it:
+        return {e.name[:-len(".pdbqt")]: Path(e.path) for e in it if e.name.lower().endswith(".pdbqt")}
 
 def resolve_stems_to_paths(folder: Path, stems):
     """Return existing paths for the given stems (without extension), error on missing."""
     if not stems:
         raise ValueError("No names provided in SELECTED_*_STEMS.")
-    available = {p.stem: p for p in folder.glob("*.pdbqt")}
+    available = _pdbqt_stem_map(folder)
     missing = [s for s in stems if s not in available]
     if missing:
         raise FileNotFoundError(
@@ -155,6 +186,24 @@ def resolve_stems_to_paths(folder: Path, stems):
         )
     return [available[s] for s in stems]
 
+def dock_pair(rec_path: Path, lig_path: Path, center, size):
+    """Dock one ligand against one receptor (runs in a worker process)."""
+    prefix = f"{lig_path.stem}_vs_{rec_path.stem}"
+    malaria_out_dir = results_root / rec_path.stem
+
+    out_pdbqt = malaria_out_dir / f"{prefix}.pdbqt"
+    log_path  = malaria_out_dir / f"{prefix}.log"
+    out_csv   = malaria_out_dir / f"{prefix}.csv"
+
+    run_vina(size=size, center=center, log_path=log_path, out_path=out_pdbqt,
+             receptor=rec_path, ligand=lig_path)
+
+    affinities = parse_affinities(log_path)
+    if affinities:
+        save_affinities_csv(affinities, out_csv)
+    else:
+        print(f"[warn] no affinities parsed from {log_path.name}")
+
 def main():
     # 1) Resolve explicit selections
     receptors = resolve_stems_to_paths(prot_folder, SELECTED_RECEPTOR_STEMS)
@@ -168,37 +217,23 @@ def main():
     processed = 0
     errors = 0
 
-    # 2) Run: each selected receptor with each selected ligand
+    # 2) Plan: each selected receptor with each selected ligand, box once per receptor
+    jobs = []
     for rec_path in receptors:
-        malaria_name = rec_path.stem
-        malaria_out_dir = results_root / malaria_name
-        malaria_out_dir.mkdir(parents=True, exist_ok=True)
-
-        # Box once per receptor
+        (results_root / rec_path.stem).mkdir(parents=True, exist_ok=True)
         center, size = build_box_for_receptor(rec_path)
+        jobs.extend((rec_path, lig_path, center, size) for lig_path in ligands)
 
-        for lig_path in ligands:
-            lig_base = lig_path.stem
-            rec_base = rec_path.stem
-            prefix = f"{lig_base}_vs_{rec_base}"
-
-            out_pdbqt = malaria_out_dir / f"{prefix}.pdbqt"
-            log_path  = malaria_out_dir / f"{prefix}.log"
-            out_csv   = malaria_out_dir / f"{prefix}.csv"
-
+    # 3) Run: MAX_WORKERS Vina processes at a time, VINA_CPU_PER_JOB cores each
+    print(f"[plan] {len(jobs)} dockings on {MAX_WORKERS} worker(s) x {VINA_CPU_PER_JOB} cpu")
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(dock_pair, *job): f"{job[1].stem}_vs_{job[0].stem}" for job in jobs}
+        for fut in as_completed(futures):
             try:
-                run_vina(size=size, center=center, log_path=log_path, out_path=out_pdbqt,
-                         receptor=rec_path, ligand=lig_path)
-
-                affinities = parse_affinities(log_path)
-                if affinities:
-                    save_affinities_csv(affinities, out_csv)
-                else:
-                    print(f"[warn] no affinities parsed from {log_path.name}")
-
+                fut.result()
                 processed += 1
             except Exception as e:
-                print(f"[error] {prefix}: {e}")
+                print(f"[error] {futures[fut]}: {e}")
                 errors += 1
 
     print(f"\nDone. Dockings run: {processed} | Errors: {errors}")
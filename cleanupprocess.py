@@ -1,5 +1,7 @@
 import os
 import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 
@@ -10,6 +12,7 @@ docking_log = 'docking_logs'
 docking_output = 'docking_output'
 Out_folder = 'OutFolder'
 col_name = "3D Interaction"
+copy_workers = 8                     # concurrent shutil.copy2 calls
 # --------------
 
 base = Path('.').resolve()
@@ -61,25 +64,46 @@ def strip_ext(name: str) -> str:
         stem = Path(stem).stem
     return stem
 
-def filename_matches(target: str, fname: str) -> bool:
+def build_target_index(targets, k: int = 4):
+    """Index normalized targets so each file is matched without scanning every target."""
+    keys = defaultdict(set)  # stripped form compared against files -> targets
+    for t in targets:
+        key = strip_ext(t)
+        if key:
+            keys[key].add(t)
+    grams = defaultdict(set)  # k-char substring -> keys containing it
+    for key in keys:
+        for i in range(len(key) - k + 1):
+            grams[key[i:i + k]].add(key)
+    return keys, sorted({len(key) for key in keys}), grams, k
+
+def matching_targets(fstem: str, index) -> set:
     # match base equality OR contains either way
-    t = strip_ext(target)
-    f = strip_ext(fname)
-    if not t or not f:
-        return False
-    return (t == f) or (t in f) or (f in t)
+    keys, lengths, grams, k = index
+    hits = set()
+    # key == fstem / key in fstem: slide a window of each key length over the stem
+    for n in lengths:
+        if n > len(fstem):
+            break
+        for i in range(len(fstem) - n + 1):
+            hits.update(keys.get(fstem[i:i + n], ()))
+    # fstem in key: only keys sharing the stem's first k chars can contain it
+    candidates = grams.get(fstem[:k], ()) if len(fstem) >= k else keys
+    for key in candidates:
+        if fstem in key:
+            hits.update(keys[key])
+    return hits
 
-def safe_copy(src: Path, dst_dir: Path):
+def unique_dest(src: Path, dst_dir: Path, taken: set) -> Path:
+    # same naming as before (name, name_1, name_2, ...), also skipping names already planned this run
     dst = dst_dir / src.name
-    if not dst.exists():
-        shutil.copy2(src, dst)
+    if dst not in taken and not dst.exists():
         return dst
     stem, suffix = dst.stem, dst.suffix
     i = 1
     while True:
         candidate = dst_dir / f"{stem}_{i}{suffix}"
-        if not candidate.exists():
-            shutil.copy2(src, candidate)
+        if candidate not in taken and not candidate.exists():
             return candidate
         i += 1
 
@@ -90,12 +114,16 @@ def main():
         return
 
     # pre-normalize targets once
-    norm_targets = {strip_ext(t) for t in targets if strip_ext(t)}
+    norm_targets = {s for s in map(strip_ext, targets) if s}
 
     copied = 0
     matched_targets = set()
     missing_targets = set(norm_targets)
 
+    index = build_target_index(norm_targets)
+    copies = []   # (src, dst), names picked serially so concurrent copies can't collide
+    taken = set()
+
     for sdir in src_dirs:
         if not sdir.exists():
             print(f"[warn] Source folder missing: {sdir}")
@@ -103,14 +131,21 @@ def main():
         for f in sdir.rglob("*"):
             if not f.is_file() or f.name.startswith("."):
                 continue
+            fstem = strip_ext(f.name)
+            if not fstem:
+                continue
             # check against ALL targets (do NOT discard after first match)
-            for t in norm_targets:
-                if filename_matches(t, f.name):
-                    safe_copy(f, out_dir)
-                    copied += 1
-                    matched_targets.add(t)
-                    # note: do NOT stop looking for t in other folders/files
-                    # we want ALL matches across ALL three dirs
+            for t in matching_targets(fstem, index):
+                dst = unique_dest(f, out_dir, taken)
+                taken.add(dst)
+                copies.append((f, dst))
+                copied += 1
+                matched_targets.add(t)
+                # note: do NOT stop looking for t in other folders/files
+                # we want ALL matches across ALL three dirs
+
+    with ThreadPoolExecutor(max_workers=copy_workers) as ex:
+        list(ex.map(lambda job: shutil.copy2(*job), copies))
 
     # report unmatched targets (those that never matched any file)
     missing_targets = norm_targets - matched_targets
@@ -6,7 +6,7 @@ pbdqt format
 """
 
 import os
-import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,32 +18,56 @@ if not os.path.exists(output_folder):
 log_file_path = os.path.join(base_dir, "failed_conversions.txt")
 failed = []
 
-prepare_script = os.path.join(base_dir,'prep_ligands.py')
+max_workers = None  # conversions run side by side, one worker process per core (capped at 61 on Windows)
 
-for filename in os.listdir(input_folder):
-    if filename.endswith(".pdb"):
-        ligand_path = os.path.join(input_folder, filename)
-        output_name = os.path.splitext(filename)[0] + ".pdbqt"
-        output_path = os.path.join(output_folder, output_name)
+def convert_one(filename):
+    """Convert one ligand .pdb to .pdbqt; return True on success."""
+    # imported per worker process, so AutoDockTools/MolKit load once per worker, not once per ligand
+    import prep_ligands
 
-        cmd = [
-            "python", prepare_script,
-            "-l", ligand_path,
-            "-o", output_path,
-            "-v"
-        ]
+    ligand_path = os.path.join(input_folder, filename)
+    output_name = os.path.splitext(filename)[0] + ".pdbqt"
+    # prep_ligands used to run with cwd=base_dir, so resolve the output path the same way
+    output_path = os.path.join(base_dir, output_folder, output_name)
 
-        try:
-            subprocess.run(cmd, cwd=base_dir, check=True)
-        except subprocess.CalledProcessError as e:
+    args = [
+        "-l", ligand_path,
+        "-o", output_path,
+        "-v"
+    ]
+
+    try:
+        prep_ligands.main(args)
+    except SystemExit as e:
+        if e.code:
             print(f"Failed: {filename}")
-            failed.append(filename)
-
-if failed:
-    with open(log_file_path, "w") as log:
-        log.write("Failed ligand conversions:\n")
-        for name in failed:
-            log.write(name + "\n")
-    print(f"\nLogged {len(failed)} failures to {log_file_path}")
-else:
-    print("\nAll ligands processed successfully.")
+            return False
+    except Exception:
+        print(f"Failed: {filename}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    filenames = [f for f in os.listdir(input_folder) if f.endswith(".pdb")]
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            futures = {ex.submit(convert_one, f): f for f in filenames}
+            for fut in as_completed(futures):
+                try:
+                    ok = fut.result()
+                except Exception as e:
+                    # e.g. BrokenProcessPool: a worker died (MolKit crash), failing its unfinished ligands
+                    print(f"Failed: {futures[fut]} ({e.__class__.__name__})")
+                    ok = False
+                if not ok:
+                    failed.append(futures[fut])
+    finally:
+        # written even if the run is cut short, so the failures so far are not lost
+        if failed:
+            with open(log_file_path, "w") as log:
+                log.write("Failed ligand conversions:\n" + "".join(name + "\n" for name in failed))
+            print(f"\nLogged {len(failed)} failures to {log_file_path}")
+
+    if not failed:
+        print("\nAll ligands processed successfully.")
@@ -1,4 +1,5 @@
 import os, sys, re, subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 base_dir = Path(__file__).resolve().parent
@@ -7,6 +8,7 @@ output_folder = base_dir / "malaria_pdbqt"
 output_folder.mkdir(parents=True, exist_ok=True)
 log_file_path = base_dir / "failed_conversions_proteins.txt"
 failed = []
+max_workers = None  # receptors converted side by side, one worker process per core (capped at 61 on Windows)
 
 def run(cmd):
     proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, shell=False)
@@ -30,7 +32,36 @@ def adt_prepare_receptor(pdb_in: Path, pdbqt_out: Path):
     ]
     return run(cmd)
 
+def has_pybel():
+    try:
+        from openbabel import pybel  # noqa
+        return True
+    except Exception:
+        return False
+
+HAS_PYBEL = has_pybel()  # checked once, not per file
+
+def pybel_prepare_receptor(pdb_in: Path, pdbqt_out: Path):
+    # Same conversion as obabel_prepare_receptor (-xr -xh) but in-process: no obabel launch per file
+    from openbabel import pybel
+    n = 0
+    try:
+        out = pybel.Outputfile("pdbqt", str(pdbqt_out), overwrite=True, opt={"r": None, "h": None})
+        try:
+            for mol in pybel.readfile("pdb", str(pdb_in)):
+                out.write(mol)
+                n += 1
+        finally:
+            out.close()
+    except Exception as e:
+        return 1, str(e)
+    if n == 0:
+        return 1, f"no molecules read from {pdb_in.name}"
+    return 0, f"{n} molecule(s) written to {pdbqt_out.name}"
+
 def obabel_prepare_receptor(pdb_in: Path, pdbqt_out: Path):
+    if HAS_PYBEL:
+        return pybel_prepare_receptor(pdb_in, pdbqt_out)
     # Explicit -i/-o is more reliable on Windows
     cmd = [
         "obabel",
@@ -40,23 +71,21 @@ def obabel_prepare_receptor(pdb_in: Path, pdbqt_out: Path):
     ]
     return run(cmd)
 
+_COORD_RE = re.compile(r'(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)')
+
 def _fix_atom_line_columns(line: str) -> str:
-    line = line.replace("\t", " ")
-    if not (line.startswith("ATOM") or line.startswith("HETATM")):
+    if "\t" in line:
+        line = line.replace("\t", " ")
+    if not line.startswith(("ATOM", "HETATM")):
         return line
     if len(line) < 80:
         line = line.rstrip("\n") + " " * (80 - len(line)) + "\n"
 
-    def try_cols(s):
-        try:
-            return float(s[30:38]), float(s[38:46]), float(s[46:54])
-        except ValueError:
-            return None
-
-    xyz = try_cols(line)
-    if xyz is None:
+    try:
+        xyz = float(line[30:38]), float(line[38:46]), float(line[46:54])
+    except ValueError:
         m = None
-        for m in re.finditer(r'(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)', line):
+        for m in _COORD_RE.finditer(line):
             pass
         if not m:
             return line
@@ -67,16 +96,16 @@ def _fix_atom_line_columns(line: str) -> str:
 
     x, y, z = xyz
     coord = f"{x:8.3f}{y:8.3f}{z:8.3f}"
-    line_list = list(line)
-    line_list[30:54] = list(coord)
-    return "".join(line_list)
+    if line[30:54] == coord:
+        return line  # already well-formed
+    return line[:30] + coord + line[54:]
 
 def sanitize_and_reflow(src: Path, dst: Path):
     with src.open("r") as fin, dst.open("w") as fout:
         for raw in fin:
             if raw.startswith(("ATOM", "HETATM")):
                 raw = _fix_atom_line_columns(raw)
-            else:
+            elif "\t" in raw:
                 raw = raw.replace("\t", " ")
             fout.write(raw)
 
@@ -95,64 +124,74 @@ def validate_pdbqt_coords(path: Path, max_lines: int = 200):
                     break
     return bad
 
-print(f"Starting conversion of PDB files from: {input_folder}")
-
-for filename in os.listdir(input_folder):
-    if not filename.lower().endswith(".pdb"):
-        continue
-
+def convert_one(filename):
+    """
+    Convert one receptor .pdb to a sanitized .pdbqt.
+    Returns (ok, log_lines); lines are printed by the caller so parallel runs don't interleave.
+    """
     pdb_in = (input_folder / filename).resolve()
     pdbqt_out = (output_folder / (pdb_in.stem + ".pdbqt")).resolve()
     tmp_out = pdbqt_out.with_suffix(".pdbqt.tmp")
     clean_out = pdbqt_out.with_suffix(".pdbqt.clean")
 
-    print(f"\nProcessing: {pdb_in.name}")
+    log = [f"\nProcessing: {pdb_in.name}"]
 
     ok = False
     if has_adt():
         code, out = adt_prepare_receptor(pdb_in, tmp_out)
         ok = (code == 0)
         if not ok:
-            print("  ADT failed, will try Open Babel.")
-            # print(out)  # uncomment to see ADT details
+            log.append("  ADT failed, will try Open Babel.")
+            # log.append(out)  # uncomment to see ADT details
     else:
-        print("  ADT not installed in this env, will try Open Babel.")
+        log.append("  ADT not installed in this env, will try Open Babel.")
 
     if not ok:
         code2, out2 = obabel_prepare_receptor(pdb_in, tmp_out)
         ok = (code2 == 0)
         if not ok:
-            print("  Open Babel failed too. Check that openbabel is installed.")
-            # print(out2)  # uncomment to see OBabel details
-            failed.append(pdb_in.name)
-            continue
+            log.append("  Open Babel failed too. Check that openbabel is installed.")
+            # log.append(out2)  # uncomment to see OBabel details
+            return False, log
 
     # sanitize/reflow -> fixed columns
     sanitize_and_reflow(tmp_out, clean_out)
     bad = validate_pdbqt_coords(clean_out, max_lines=200)
     if bad:
-        print("  Validation found malformed lines (showing up to 5):")
+        log.append("  Validation found malformed lines (showing up to 5):")
         for i, L in bad[:5]:
-            print(f"    line {i}: {L}")
-        failed.append(pdb_in.name)
-        continue
+            log.append(f"    line {i}: {L}")
+        return False, log
 
     try:
         if pdbqt_out.exists():
             pdbqt_out.unlink()
         clean_out.rename(pdbqt_out)
         tmp_out.unlink(missing_ok=True)
-        print(f"  OK -> {pdbqt_out}")
+        log.append(f"  OK -> {pdbqt_out}")
+        return True, log
     except Exception as e:
-        print(f"  Error finalizing {pdbqt_out.name}: {e}")
-        failed.append(pdb_in.name)
-
-# Report
-if failed:
-    with open(log_file_path, "w") as log:
-        log.write("Failed protein conversions:\n")
-        for name in failed:
-            log.write(name + "\n")
-    print(f"\nLogged {len(failed)} failures to {log_file_path}")
-else:
-    print("\nAll receptor PDB files processed successfully.")
+        log.append(f"  Error finalizing {pdbqt_out.name}: {e}")
+        return False, log
+
+if __name__ == "__main__":
+    print(f"Starting conversion of PDB files from: {input_folder}")
+
+    filenames = [f for f in os.listdir(input_folder) if f.lower().endswith(".pdb")]
+
+    # Worker processes, not threads: the pybel fallback converts in-process and holds the GIL
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(convert_one, f): f for f in filenames}
+        for fut in as_completed(futures):
+            ok, log = fut.result()
+            print("\n".join(log))
+            if not ok:
+                failed.append(futures[fut])
+
+    # Report
+    if failed:
+        with open(log_file_path, "w") as log:
+            log.write("Failed protein conversions:\n" + "".join(name + "\n" for name in failed))
+        print(f"\nLogged {len(failed)} failures to {log_file_path}")
+    else:
+        print("\nAll receptor PDB files processed successfully.")
@@ -20,7 +20,7 @@ import getopt
 
 
 
-def main():
+def main(argv=None):
 
     def usage():
         """Print helpful, accurate usage statement to stdout."""
@@ -59,7 +59,7 @@ def main():
 
     # process command arguments
     try:
-        opt_list, args = getopt.getopt(sys.argv[1:], 'l:vo:d:A:Cp:U:B:R:MFI:Zgsh')
+        opt_list, args = getopt.getopt(sys.argv[1:] if argv is None else argv, 'l:vo:d:A:Cp:U:B:R:MFI:Zgsh')
     except getopt.GetoptError as msg:
         print('prepare_ligand4.py: %s' % msg)
         usage()
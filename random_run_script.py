@@ -1,12 +1,22 @@
 import os
+import atexit
 import sys
+import re
+import mmap
 import subprocess
-import pandas as pd
+import csv
 import numpy as np
 import json
 import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib decoder is used instead
+    orjson = None
+
 # ---------------- Config ----------------
 #vina_executable = r"/usr/local/bin/vina"  # on Mac / Linux
 vina_executable = r"C:\Program Files (x86)\PyRx\vina.exe"  # on Windows
@@ -15,6 +25,10 @@ NUM_RECEPTORS = 20            # pick up to this many random receptors
 LIGANDS_PER_RECEPTOR = 2      # random ligands per receptor
 AUTO_BOX_SIZE = (25.0, 25.0, 25.0)
 HEAVY_ATOM_BUFFER = 5.0
+VINA_CPU_PER_JOB = 2          # --cpu given to each Vina run
+MAX_WORKERS = max(1, (os.cpu_count() or 1) // VINA_CPU_PER_JOB)  # concurrent Vina runs
+BOX_IO_WORKERS = 8            # receptors read/boxed side by side before docking
+PRINT_VINA_LOG = False        # echo each finished Vina log to the console (it is always saved in results/<receptor>/logs)
 # ---------------------------------------
 
 base_dir = Path(__file__).resolve().parent
@@ -24,48 +38,121 @@ results_root = base_dir / "results"
 results_root.mkdir(parents=True, exist_ok=True)
 
 binding_centers_path = base_dir / "Center_boxes.json"
+auto_box_cache_path = base_dir / "auto_box_cache.json"
 
 # Load precomputed centers if present
 if binding_centers_path.exists():
-    with open(binding_centers_path, "r") as f:
-        BINDING_CENTERS = json.load(f)
+    if orjson is not None:
+        BINDING_CENTERS = orjson.loads(binding_centers_path.read_bytes())
+    else:
+        with open(binding_centers_path, "r") as f:
+            BINDING_CENTERS = json.load(f)
     print(f"[info] loaded binding centers from {binding_centers_path} ({len(BINDING_CENTERS)} entries)")
 else:
     BINDING_CENTERS = {}
     print("[info] Center_boxes.json not found, will use receptor-based auto box.")
 
+# Receptor-based centers from earlier runs: {stem: {"key": [mtime_ns, size], "center": [x, y, z]}}
+if auto_box_cache_path.exists():
+    with open(auto_box_cache_path, "r") as f:
+        AUTO_BOX_CACHE = json.load(f)
+else:
+    AUTO_BOX_CACHE = {}
+_auto_box_dirty = False
+
+
+def _flush_auto_box_cache():
+    """Write AUTO_BOX_CACHE back once at exit (only in the process that planned the run)."""
+    if not _auto_box_dirty:
+        return
+    tmp_path = auto_box_cache_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(AUTO_BOX_CACHE, f, indent=2)
+    os.replace(tmp_path, auto_box_cache_path)
+
+
+atexit.register(_flush_auto_box_cache)
+
+
+_ATOM_RECORD_RE = re.compile(rb"^(?:ATOM|HETATM)[^\r\n]*", re.M)
+
+
+def _read_atom_records(pdbqt_path: Path):
+    """ATOM/HETATM lines of a PDBQT as bytes, scanned straight off an mmap of the file."""
+    with open(pdbqt_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _ATOM_RECORD_RE.findall(mm)
+
+
+def _heavy_atom_coords(records):
+    """
+    Fixed-width coords of ATOM/HETATM byte records as an (N, 3) float array.
+    Hydrogens and rows with malformed coordinate fields are dropped.
+    """
+    if not records:
+        return np.empty((0, 3))
+    cols = np.array(records, dtype="S80").view(np.uint8).reshape(len(records), 80)
+    # hydrogen = first non-blank byte of the atom name (cols 12-16) is 'H'
+    names = cols[:, 12:16]
+    first = np.argmax((names != ord(" ")) & (names != ord("\t")), axis=1)
+    heavy = names[np.arange(len(names)), first] != ord("H")
+    fields = np.ascontiguousarray(cols[heavy, 30:54]).view("S8")  # (N, 3)
+    try:
+        return fields.astype(np.float64)
+    except ValueError:
+        # rare malformed rows: convert field by field and drop the bad rows
+        coords = np.full(fields.shape, np.nan)
+        for idx, field in np.ndenumerate(fields):
+            try:
+                coords[idx] = float(field)
+            except ValueError:
+                pass
+        return coords[~np.isnan(coords).any(axis=1)]
+
+
+def _heavy_atom_stats(pdbqt_path: Path):
+    """(center, min, max) of the heavy-atom coords, or None if there are none."""
+    coords = _heavy_atom_coords(_read_atom_records(pdbqt_path))
+    if len(coords) == 0:
+        return None
+    return coords.mean(axis=0), coords.min(axis=0), coords.max(axis=0)
+
 
 def estimate_docking_box_from_pdbqt(pdbqt_path: Path, buffer: float = HEAVY_ATOM_BUFFER):
-    xs, ys, zs = [], [], []
     try:
-        with open(pdbqt_path, "r") as f:
-            for line in f:
-                if not (line.startswith("ATOM") or line.startswith("HETATM")):
-                    continue
-                atom_name = line[12:16].strip()
-                if atom_name.startswith("H"):
-                    continue
-                try:
-                    x = float(line[30:38]); y = float(line[38:46]); z = float(line[46:54])
-                    xs.append(x); ys.append(y); zs.append(z)
-                except ValueError:
-                    continue
+        stats = _heavy_atom_stats(pdbqt_path)
     except FileNotFoundError:
         print(f"[warn] receptor file not found for auto box: {pdbqt_path}")
         return (0.0, 0.0, 0.0), (25.0, 25.0, 25.0)
 
-    if not xs:
+    if stats is None:
         print(f"[warn] no heavy-atom coords parsed; using (0,0,0) and 25 Å for {pdbqt_path.name}.")
         return (0.0, 0.0, 0.0), (25.0, 25.0, 25.0)
 
-    coords = np.array(list(zip(xs, ys, zs)))
-    center = coords.mean(axis=0)
-    minc = coords.min(axis=0)
-    maxc = coords.max(axis=0)
+    center, minc, maxc = stats
     size = (maxc - minc) + buffer
     return (tuple(center), tuple(size))
 
 
+def _auto_box_center(receptor_path: Path):
+    """Receptor-based box center, reused from auto_box_cache.json while the file is unchanged."""
+    global _auto_box_dirty
+    try:
+        st = receptor_path.stat()
+    except FileNotFoundError:
+        return estimate_docking_box_from_pdbqt(receptor_path)[0]  # warns and falls back
+    key = [st.st_mtime_ns, st.st_size]
+    hit = AUTO_BOX_CACHE.get(receptor_path.stem)
+    if hit is not None and hit["key"] == key:
+        return tuple(hit["center"])
+    center = tuple(float(c) for c in estimate_docking_box_from_pdbqt(receptor_path)[0])
+    AUTO_BOX_CACHE[receptor_path.stem] = {"key": key, "center": list(center)}
+    _auto_box_dirty = True
+    return center
+
+
 def build_box_for_receptor(receptor_path: Path):
     rec_stem = receptor_path.stem
     if rec_stem in BINDING_CENTERS:
@@ -74,13 +161,14 @@ def build_box_for_receptor(receptor_path: Path):
         size   = tuple(data["size"])
         print(f"[site-box] {rec_stem}: center={center}, size={size}")
         return center, size
-    center, _ = estimate_docking_box_from_pdbqt(receptor_path)
+    center = _auto_box_center(receptor_path)
     size = AUTO_BOX_SIZE
     print(f"[auto-box] {rec_stem}: center={center}, size={size}")
     return center, size
 
 
-def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path):
+def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path,
+             cpu: int = VINA_CPU_PER_JOB):
     log_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -95,50 +183,48 @@ def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligan
         "--size_y", str(size[1]),
         "--size_z", str(size[2]),
         "--out", str(out_path),
-        "--cpu", "1",
+        "--cpu", str(cpu),
     ]
 
     pretty = " ".join(f'"{c}"' if " " in c else c for c in cmd)
     print("\n[run] AutoDock Vina:\n", pretty, "\n")
 
-    proc = subprocess.run(cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    with open(log_path, "w") as lf:
-        lf.write(proc.stdout or "")
+    # Vina writes to the log file directly; it is only read back here if PRINT_VINA_LOG is set
+    with open(log_path, "wb") as lf:
+        proc = subprocess.run(cmd, stdout=lf, stderr=subprocess.STDOUT)
 
-    if proc.stdout:
-        print(proc.stdout)
+    if PRINT_VINA_LOG:
+        stdout = log_path.read_text()
+        if stdout:
+            print(stdout)
 
     if proc.returncode != 0:
         raise RuntimeError(f"Vina failed (exit {proc.returncode}). See log: {log_path}")
 
 
+# "<mode> <affinity> ..." rows of the Vina results table
+_AFFINITY_RE = re.compile(rb"^[ \t]*\d+[ \t]+(-?\d+(?:\.\d+)?)(?=\s|$)", re.M)
+
+
 def parse_affinities(log_path: Path):
-    affinities = []
     if not log_path.exists():
-        return affinities
-    with open(log_path, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            if parts and parts[0].isdigit() and len(parts) >= 2:
-                try:
-                    affinities.append(float(parts[1]))
-                except ValueError:
-                    pass
-    return affinities[:10]
+        return []
+    matches = islice(_AFFINITY_RE.finditer(log_path.read_bytes()), 10)
+    return [float(m.group(1)) for m in matches]
 
 
 def save_to_csv(affinities, prefix: str, csv_dir: Path):
-    df = pd.DataFrame({
-        "Rank": list(range(1, len(affinities) + 1)),
-        "Binding_Affinity_kcal/mol": affinities
-    })
     csv_dir.mkdir(parents=True, exist_ok=True)
     csv_file = csv_dir / f"{prefix}.csv"
-    df.to_csv(csv_file, index=False)
+    with open(csv_file, "w", newline="") as f:
+        w = csv.writer(f, lineterminator=os.linesep)  # DataFrame.to_csv default
+        w.writerow(["Rank", "Binding_Affinity_kcal/mol"])
+        w.writerows(enumerate(affinities, 1))
     print(f"[ok] saved CSV: {csv_file}")
 
 
-def run_docking_pair(ligand_path: Path, receptor_path: Path, out_dir: Path, log_dir: Path, csv_dir: Path):
+def run_docking_pair(ligand_path: Path, receptor_path: Path, center, size,
+                     out_dir: Path, log_dir: Path, csv_dir: Path):
     lig_base = ligand_path.stem
     rec_base = receptor_path.stem
     prefix = f"{lig_base}_vs_{rec_base}"
@@ -146,13 +232,7 @@ def run_docking_pair(ligand_path: Path, receptor_path: Path, out_dir: Path, log_
     out_pdbqt = out_dir / f"{prefix}.pdbqt"
     log_path  = log_dir / f"{prefix}.log"
 
-    # Skip if output already exists
-    if out_pdbqt.exists():
-        print(f"[skip] exists: {out_pdbqt.name}")
-        return
-
-    center, size = build_box_for_receptor(receptor_path)
-
+    # (pairs whose output already exists are skipped by main before they get here)
     run_vina(size=size, center=center, log_path=log_path, out_path=out_pdbqt,
              receptor=receptor_path, ligand=ligand_path)
 
@@ -163,6 +243,15 @@ def run_docking_pair(ligand_path: Path, receptor_path: Path, out_dir: Path, log_
         print(f"[warn] No affinities parsed. Check log: {log_path}")
 
 
+def list_pdbqt(folder: Path):
+    """Sorted .pdbqt paths in folder, listed in one os.scandir pass (no per-file stat)."""
+    try:
+        with os.scandir(folder) as it:
+            return sorted(Path(e.path) for e in it if e.name.lower().endswith(".pdbqt"))
+    except FileNotFoundError:
+        return []
+
+
 def pick_random(paths, k):
     if k <= 0:
         return []
@@ -175,8 +264,8 @@ def main():
     if RANDOM_SEED is not None:
         random.seed(RANDOM_SEED)
 
-    lig_all = sorted(lig_folder.glob("*.pdbqt"))
-    rec_all = sorted(prot_folder.glob("*.pdbqt"))
+    lig_all = list_pdbqt(lig_folder)
+    rec_all = list_pdbqt(prot_folder)
     print(f"[inventory] ligands: {len(lig_all)} | receptors: {len(rec_all)}")
 
     if len(lig_all) == 0 or len(rec_all) == 0:
@@ -186,9 +275,16 @@ def main():
     receptors = pick_random(rec_all, NUM_RECEPTORS)
     print(f"[plan] receptors (random {len(receptors)}): {[p.stem for p in receptors]}")
 
+    # Box every picked receptor up front, here in the parent so new auto boxes land in
+    # AUTO_BOX_CACHE; threads overlap the (often cold-cache) receptor reads
+    with ThreadPoolExecutor(max_workers=max(1, min(BOX_IO_WORKERS, len(receptors)))) as ex:
+        boxes = dict(zip(receptors, ex.map(build_box_for_receptor, receptors)))
+
     processed = 0
     errors = 0
 
+    # Plan every (ligand, receptor) pair first; random picks stay in the same order as a serial run
+    tasks = []
     for rec_path in receptors:
         rec_stem = rec_path.stem
         rec_root = results_root / rec_stem
@@ -198,6 +294,8 @@ def main():
         out_dir.mkdir(parents=True, exist_ok=True)
         log_dir.mkdir(parents=True, exist_ok=True)
         csv_dir.mkdir(parents=True, exist_ok=True)
+        with os.scandir(out_dir) as it:
+            done = {e.name for e in it}  # outputs from earlier runs, listed once per receptor
 
         # Randomly pick two *different* ligands
         if len(lig_all) < LIGANDS_PER_RECEPTOR:
@@ -207,13 +305,26 @@ def main():
 
         print(f"[plan] {rec_stem}: ligands -> {[p.stem for p in ligands]}")
 
+        center, size = boxes[rec_path]
         for lig_path in ligands:
-            pair = f"{lig_path.stem} vs {rec_stem}"
+            # Skip if output already exists
+            out_name = f"{lig_path.stem}_vs_{rec_stem}.pdbqt"
+            if out_name in done:
+                print(f"[skip] exists: {out_name}")
+                processed += 1  # counted as before, when the pair returned early
+                continue
+            tasks.append((lig_path, rec_path, center, size, out_dir, log_dir, csv_dir))
+
+    # MAX_WORKERS Vina processes at a time, VINA_CPU_PER_JOB cores each
+    print(f"[plan] {len(tasks)} dockings on {MAX_WORKERS} worker(s) x {VINA_CPU_PER_JOB} cpu")
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(run_docking_pair, *task): f"{task[0].stem} vs {task[1].stem}" for task in tasks}
+        for fut in as_completed(futures):
             try:
-                run_docking_pair(lig_path, rec_path, out_dir, log_dir, csv_dir)
+                fut.result()
                 processed += 1
             except Exception as e:
-                print(f"[error] {pair}: {e}")
+                print(f"[error] {futures[fut]}: {e}")
                 errors += 1
 
     print(f"\nDone. Processed: {processed} | Errors: {errors}\n")
@@ -29,6 +29,8 @@ for drug, group in df.groupby(drug_col):
 #merge all the cleaned csvs back together
 import pandas as pd
 import os
+import io
+import csv
 from pathlib import Path
 
 # ===== CONFIG =====
@@ -39,21 +41,62 @@ output_csv = "merged.csv"         # final merged CSV
 # Collect all CSV files in the folder
 csv_files = list(input_folder.glob("*.csv"))
 
-# Merge all into one DataFrame
-dfs = []
+def source_suffix(name):
+    """b',<name>' for the Source_File column, quoted the way csv/pandas would quote it."""
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="").writerow(["", name])
+    return buf.getvalue().encode("utf-8")
+
+# Read every file first; if the headers all match and nothing is quoted, the bodies can
+# be copied as raw bytes (each physical line is then exactly one row)
+headers = []
+bodies = []
 for file in csv_files:
-    try:
-        df = pd.read_csv(file)
-        df["Source_File"] = file.name  # optional: track which file it came from
-        dfs.append(df)
-        print(f"[merged] {file.name} ({len(df)} rows)")
-    except Exception as e:
-        print(f"[skip] {file.name} ({e})")
-
-# Concatenate all DataFrames and save
-if dfs:
-    merged_df = pd.concat(dfs, ignore_index=True)
-    merged_df.to_csv(output_csv, index=False)
-    print(f"\nMerged {len(csv_files)} files into '{output_csv}' ({len(merged_df)} total rows)")
+    with open(file, "rb") as f:
+        headers.append(f.readline().rstrip(b"\r\n").removeprefix(b"\xef\xbb\xbf"))
+        bodies.append(f.read())
+same_schema = (bool(headers) and all(headers) and len(set(headers)) == 1
+               and b"Source_File" not in headers[0].split(b",")
+               and not any(b'"' in h or b'"' in body for h, body in zip(headers, bodies)))
+# ...and only if every row has the header's field count (unquoted, so counting commas is exact);
+# short or long rows go through pandas, which pads or rejects them
+if same_schema:
+    n_commas = headers[0].count(b",")
+    same_schema = all(line.count(b",") == n_commas
+                      for body in bodies for line in body.splitlines() if line)
+
+if same_schema:
+    # Fast path: header once, then each file's rows with the Source_File column appended
+    eol = os.linesep.encode()  # same line terminator DataFrame.to_csv writes
+    total = 0
+    with open(output_csv, "wb", buffering=1 << 20) as out:
+        out.write(headers[0] + b",Source_File" + eol)
+        for file, body in zip(csv_files, bodies):
+            suffix = source_suffix(file.name) + eol
+            rows = 0
+            for line in body.splitlines():
+                if line:  # pandas skips blank lines
+                    out.write(line + suffix)
+                    rows += 1
+            total += rows
+            print(f"[merged] {file.name} ({rows} rows)")
+    print(f"\nMerged {len(csv_files)} files into '{output_csv}' ({total} total rows)")
 else:
-    print("No valid CSV files found.")
+    # Merge all into one DataFrame (headers differ, so let pandas align the columns)
+    dfs = []
+    for file in csv_files:
+        try:
+            df = pd.read_csv(file)
+            df["Source_File"] = file.name  # optional: track which file it came from
+            dfs.append(df)
+            print(f"[merged] {file.name} ({len(df)} rows)")
+        except Exception as e:
+            print(f"[skip] {file.name} ({e})")
+
+    # Concatenate all DataFrames and save
+    if dfs:
+        merged_df = pd.concat(dfs, ignore_index=True)
+        merged_df.to_csv(output_csv, index=False)
+        print(f"\nMerged {len(csv_files)} files into '{output_csv}' ({len(merged_df)} total rows)")
+    else:
+        print("No valid CSV files found.")
@@ -1,15 +1,32 @@
 import os
+import atexit
 import sys
+import re
+import mmap
 import json
 import subprocess
+import csv
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
 import numpy as np
-import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib decoder is used instead
+    orjson = None
 
 # ====== CONFIG ======
 #vina_executable = r"C:\Program Files (x86)\PyRx\vina.exe" # on Windows
 vina_executable = r"/usr/local/bin/vina"   # on Mac/Linux
 TIMEOUT_SECONDS = 400  # 5 minutes per docking
+VINA_CPU_PER_JOB = 2   # --cpu given to each Vina run
+MAX_WORKERS = max(1, (os.cpu_count() or 1) // VINA_CPU_PER_JOB)  # concurrent Vina runs
+BOX_IO_WORKERS = 8     # receptors read/boxed side by side before docking
+PIN_WORKERS = True     # pin each worker (and its Vina) to its own VINA_CPU_PER_JOB cores; Linux only, set False on shared nodes
+PRINT_VINA_LOG = False # echo each finished Vina log to the console (it is always saved in docking_logs)
 # ====================
 
 base_dir = Path(__file__).resolve().parent
@@ -20,68 +37,148 @@ prot_folder = base_dir / "malaria_pdbqt"
 csv_folder = base_dir / "top10_affinities"
 
 binding_centers_path = base_dir / "Center_boxes.json"
+auto_box_cache_path = base_dir / "auto_box_cache.json"
 stuck_log_path = log_folder / "stuck_timeouts.txt"  # <- where we record timeouts
 
 # ------------------------------------------
 # Load precomputed centers if present
 if binding_centers_path.exists():
-    with open(binding_centers_path, "r") as f:
-        BINDING_CENTERS = json.load(f)
+    if orjson is not None:
+        BINDING_CENTERS = orjson.loads(binding_centers_path.read_bytes())
+    else:
+        with open(binding_centers_path, "r") as f:
+            BINDING_CENTERS = json.load(f)
     print(f"[info] loaded binding centers from {binding_centers_path} ({len(BINDING_CENTERS)} entries)")
 else:
     BINDING_CENTERS = {}
     print("[info] Center_boxes.json not found, will use receptor-based auto box.")
 
+# (center, size) tuples built once per receptor stem
+BOX_CACHE = {k: (tuple(v["center"]), tuple(v["size"])) for k, v in BINDING_CENTERS.items()}
+AUTO_BOX_SIZE = (25.0, 25.0, 25.0)
 
-def estimate_docking_box_from_pdbqt(pdbqt_path: Path, buffer: float = 5.0):
-    xs, ys, zs = [], [], []
-    with open(pdbqt_path, "r") as f:
-        for line in f:
-            if not (line.startswith("ATOM") or line.startswith("HETATM")):
-                continue
-            atom_name = line[12:16].strip()
-            if atom_name.startswith("H"):
-                continue
+# Receptor-based centers from earlier runs: {stem: {"key": [mtime_ns, size], "center": [x, y, z]}}
+if auto_box_cache_path.exists():
+    with open(auto_box_cache_path, "r") as f:
+        AUTO_BOX_CACHE = json.load(f)
+else:
+    AUTO_BOX_CACHE = {}
+_auto_box_dirty = False
+
+
+def _flush_auto_box_cache():
+    """Write AUTO_BOX_CACHE back once at exit (only in the process that planned the run)."""
+    if not _auto_box_dirty:
+        return
+    tmp_path = auto_box_cache_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(AUTO_BOX_CACHE, f, indent=2)
+    os.replace(tmp_path, auto_box_cache_path)
+
+
+atexit.register(_flush_auto_box_cache)
+
+
+_ATOM_RECORD_RE = re.compile(rb"^(?:ATOM|HETATM)[^\r\n]*", re.M)
+
+
+def _read_atom_records(pdbqt_path: Path):
+    """ATOM/HETATM lines of a PDBQT as bytes, scanned straight off an mmap of the file."""
+    with open(pdbqt_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _ATOM_RECORD_RE.findall(mm)
+
+
+def _heavy_atom_coords(records):
+    """
+    Fixed-width coords of ATOM/HETATM byte records as an (N, 3) float array.
+    Hydrogens and rows with malformed coordinate fields are dropped.
+    """
+    if not records:
+        return np.empty((0, 3))
+    cols = np.array(records, dtype="S80").view(np.uint8).reshape(len(records), 80)
+    # hydrogen = first non-blank byte of the atom name (cols 12-16) is 'H'
+    names = cols[:, 12:16]
+    first = np.argmax((names != ord(" ")) & (names != ord("\t")), axis=1)
+    heavy = names[np.arange(len(names)), first] != ord("H")
+    fields = np.ascontiguousarray(cols[heavy, 30:54]).view("S8")  # (N, 3)
+    try:
+        return fields.astype(np.float64)
+    except ValueError:
+        # rare malformed rows: convert field by field and drop the bad rows
+        coords = np.full(fields.shape, np.nan)
+        for idx, field in np.ndenumerate(fields):
             try:
-                x = float(line[30:38]); y = float(line[38:46]); z = float(line[46:54])
-                xs.append(x); ys.append(y); zs.append(z)
+                coords[idx] = float(field)
             except ValueError:
-                continue
+                pass
+        return coords[~np.isnan(coords).any(axis=1)]
 
-    if not xs:
+
+def _heavy_atom_stats(pdbqt_path: Path):
+    """(center, min, max) of the heavy-atom coords, or None if there are none."""
+    coords = _heavy_atom_coords(_read_atom_records(pdbqt_path))
+    if len(coords) == 0:
+        return None
+    return coords.mean(axis=0), coords.min(axis=0), coords.max(axis=0)
+
+
+def estimate_docking_box_from_pdbqt(pdbqt_path: Path, buffer: float = 5.0):
+    try:
+        stats = _heavy_atom_stats(pdbqt_path)
+    except FileNotFoundError:
+        print(f"[warn] receptor file not found for auto box: {pdbqt_path}")
+        return (0.0, 0.0, 0.0), (25.0, 25.0, 25.0)
+
+    if stats is None:
         print(f"[warn] no heavy-atom coords parsed; using (0,0,0) and 25 Å for {pdbqt_path.name}.")
         return (0.0, 0.0, 0.0), (25.0, 25.0, 25.0)
 
-    coords = np.array(list(zip(xs, ys, zs)))
-    center = coords.mean(axis=0)
-    minc = coords.min(axis=0)
-    maxc = coords.max(axis=0)
+    center, minc, maxc = stats
     size = (maxc - minc) + buffer
     return (tuple(center), tuple(size))
 
 
+def _auto_box_center(receptor_path: Path):
+    """Receptor-based box center, reused from auto_box_cache.json while the file is unchanged."""
+    global _auto_box_dirty
+    try:
+        st = receptor_path.stat()
+    except FileNotFoundError:
+        return estimate_docking_box_from_pdbqt(receptor_path)[0]  # warns and falls back
+    key = [st.st_mtime_ns, st.st_size]
+    hit = AUTO_BOX_CACHE.get(receptor_path.stem)
+    if hit is not None and hit["key"] == key:
+        return tuple(hit["center"])
+    center = tuple(float(c) for c in estimate_docking_box_from_pdbqt(receptor_path)[0])
+    AUTO_BOX_CACHE[receptor_path.stem] = {"key": key, "center": list(center)}
+    _auto_box_dirty = True
+    return center
+
+
 def build_box_for_receptor(receptor_path: Path):
     rec_stem = receptor_path.stem
-    if rec_stem in BINDING_CENTERS:
-        data = BINDING_CENTERS[rec_stem]
-        center = tuple(data["center"])
-        size   = tuple(data["size"])
-        print(f"[site-box] {rec_stem}: center={center}, size={size}")
-        return center, size
-    center, _ = estimate_docking_box_from_pdbqt(receptor_path)
-    size = (25.0, 25.0, 25.0)
-    print(f"[auto-box] {rec_stem}: center={center}, size={size}")
-    return center, size
-
-
-def append_stuck(pair_prefix: str, reason: str):
-    """Append the stuck/timeout pair to a log file."""
-    log_folder.mkdir(parents=True, exist_ok=True)
+    box = BOX_CACHE.get(rec_stem)
+    if box is not None:
+        print(f"[site-box] {rec_stem}: center={box[0]}, size={box[1]}")
+        return box
+    box = (_auto_box_center(receptor_path), AUTO_BOX_SIZE)
+    print(f"[auto-box] {rec_stem}: center={box[0]}, size={box[1]}")
+    return box
+
+
+def append_stuck(entries):
+    """Append the stuck/timeout (pair_prefix, reason) entries to a log file in one write."""
+    if not entries:
+        return
     with open(stuck_log_path, "a", encoding="utf-8") as f:
-        f.write(f"{pair_prefix}\t{reason}\n")
+        f.write("".join(f"{pair_prefix}\t{reason}\n" for pair_prefix, reason in entries))
 
 
-def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path):
+def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligand: Path,
+             cpu: int = VINA_CPU_PER_JOB):
     """
     Run vina with a hard timeout.
     On timeout: kill process, write partial stdout to log, raise TimeoutError.
@@ -97,66 +194,56 @@ def run_vina(size, center, log_path: Path, out_path: Path, receptor: Path, ligan
         "--size_y", str(size[1]),
         "--size_z", str(size[2]),
         "--out", str(out_path),
-        "--cpu", "1",
+        "--cpu", str(cpu),
     ]
 
     pretty = " ".join(f'"{c}"' if " " in c else c for c in cmd)
     print("\n[run] AutoDock Vina:\n", pretty, "\n")
 
-    # Use Popen + communicate(timeout=...) so we can kill on timeout
-    log_path.parent.mkdir(parents=True, exist_ok=True)
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-
-    try:
-        stdout, _ = proc.communicate(timeout=TIMEOUT_SECONDS)
-        # Save stdout as our log file
-        with open(log_path, "w", encoding="utf-8") as lf:
-            lf.write(stdout or "")
-        print(stdout)
-        if proc.returncode != 0:
-            raise RuntimeError(f"Vina failed (exit {proc.returncode}). See log: {log_path}")
-    except subprocess.TimeoutExpired:
-        # Kill process and collect whatever it wrote
-        proc.kill()
+    # Use Popen + wait(timeout=...) so we can kill on timeout; Vina writes straight into the log file
+    with open(log_path, "wb") as lf:
+        # close_fds=False lets CPython launch Vina with posix_spawn instead of fork+exec;
+        # Python's own fds are non-inheritable anyway, so only the log fd reaches Vina
+        proc = subprocess.Popen(cmd, stdout=lf, stderr=subprocess.STDOUT, close_fds=False)
         try:
-            stdout, _ = proc.communicate(timeout=10)
-        except Exception:
-            stdout = ""
-        with open(log_path, "w", encoding="utf-8") as lf:
-            lf.write(stdout or "")
-        raise TimeoutError(f"Vina timed out after {TIMEOUT_SECONDS}s. See log: {log_path}")
+            proc.wait(timeout=TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            # Kill process; whatever it wrote is already in the log
+            proc.kill()
+            try:
+                proc.wait(timeout=10)
+            except Exception:
+                pass
+            raise TimeoutError(f"Vina timed out after {TIMEOUT_SECONDS}s. See log: {log_path}")
+
+    if PRINT_VINA_LOG:
+        print(log_path.read_text(encoding="utf-8"))
+    if proc.returncode != 0:
+        raise RuntimeError(f"Vina failed (exit {proc.returncode}). See log: {log_path}")
+
+
+# "<mode> <affinity> ..." rows of the Vina results table
+_AFFINITY_RE = re.compile(rb"^[ \t]*\d+[ \t]+(-?\d+(?:\.\d+)?)(?=\s|$)", re.M)
 
 
 def parse_affinities(log_path: Path):
-    affinities = []
     if not log_path.exists():
-        return affinities
-    with open(log_path, "r", encoding="utf-8") as f:
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
-            parts = s.split()
-            if len(parts) >= 2 and parts[0].isdigit():
-                try:
-                    affinities.append(float(parts[1]))
-                except ValueError:
-                    pass
-    return affinities[:10]
+        return []
+    matches = islice(_AFFINITY_RE.finditer(log_path.read_bytes()), 10)
+    return [float(m.group(1)) for m in matches]
 
 
 def save_to_csv(affinities, prefix: str, csv_dir: Path):
-    df = pd.DataFrame({
-        "Rank": list(range(1, len(affinities) + 1)),
-        "Binding_Affinity_kcal/mol": affinities
-    })
-    csv_dir.mkdir(parents=True, exist_ok=True)
     csv_file = csv_dir / f"{prefix}.csv"
-    df.to_csv(csv_file, index=False)
+    with open(csv_file, "w", newline="") as f:
+        w = csv.writer(f, lineterminator=os.linesep)  # DataFrame.to_csv default
+        w.writerow(["Rank", "Binding_Affinity_kcal/mol"])
+        w.writerows(enumerate(affinities, 1))
     print(f"[ok] saved CSV: {csv_file}")
 
 
-def run_docking_pair(ligand_path: Path, receptor_path: Path):
+def run_docking_pair(ligand_path: Path, receptor_path: Path, center, size):
+    """Dock one pair (runs in a worker process). Returns "ok", "timeout", "error" or None (skipped / no affinities)."""
     lig_base = ligand_path.stem
     rec_base = receptor_path.stem
     prefix = f"{lig_base}"
@@ -164,13 +251,7 @@ def run_docking_pair(ligand_path: Path, receptor_path: Path):
     out_pdbqt = output_folder / f"{prefix}.pdbqt"
     log_path  = log_folder   / f"{prefix}.log"
 
-    # Skip if output already exists
-    if out_pdbqt.exists():
-        print(f"[skip] Output already exists: {out_pdbqt.name}. Skipping docking for this pair.")
-        return
-
-    center, size = build_box_for_receptor(receptor_path)
-
+    # (pairs whose output already exists are skipped by main before they get here)
     try:
         run_vina(size=size, center=center, log_path=log_path, out_path=out_pdbqt,
                  receptor=receptor_path, ligand=ligand_path)
@@ -182,8 +263,7 @@ def run_docking_pair(ligand_path: Path, receptor_path: Path):
                 out_pdbqt.unlink()
             except Exception:
                 pass
-        append_stuck(prefix, "timeout")
-        return
+        return "timeout"
     except Exception as e:
         print(f"[error] {prefix}: {e}")
         # If there is a broken partial file, remove it to avoid false skips later
@@ -192,25 +272,52 @@ def run_docking_pair(ligand_path: Path, receptor_path: Path):
                 out_pdbqt.unlink()
             except Exception:
                 pass
-        append_stuck(prefix, "error")
-        return
+        return "error"
 
     affinities = parse_affinities(log_path)
     if affinities:
         save_to_csv(affinities, prefix, csv_folder)
-    else:
-        print(f"[warn] No affinities parsed. Check log: {log_path}")
+        return "ok"
+    print(f"[warn] No affinities parsed. Check log: {log_path}")
+    return None
+
+
+def worker_core_sets():
+    """One disjoint VINA_CPU_PER_JOB-core set per worker, or None if pinning is off or not possible here."""
+    if not PIN_WORKERS or not hasattr(os, "sched_setaffinity"):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < MAX_WORKERS * VINA_CPU_PER_JOB:
+        return None  # fewer usable cores than the pool assumes (e.g. cgroup limits): leave scheduling to the OS
+    return [set(cores[i * VINA_CPU_PER_JOB:(i + 1) * VINA_CPU_PER_JOB]) for i in range(MAX_WORKERS)]
+
+
+def _pin_worker(core_sets):
+    """Pool initializer: claim the next free core set; the Vina processes this worker starts inherit it."""
+    try:
+        os.sched_setaffinity(0, core_sets.get(timeout=5))
+    except (queue.Empty, OSError):
+        pass  # run unpinned rather than fail the worker
+
+
+def pdbqt_stem_map(folder: Path):
+    """{stem: path} for the .pdbqt files in folder, listed in one os.scandir pass (no per-file stat)."""
+    try:
+        with os.scandir(folder) as it:
+            return {e.name[:-len(".pdbqt")]: Path(e.path) for e in it if e.name.lower().endswith(".pdbqt")}
+    except FileNotFoundError:
+        return {}
 
 
 if __name__ == "__main__":
-    # Ensure output dirs exist
+    # Ensure output dirs exist (created only here; run_vina/save_to_csv/append_stuck rely on it)
     output_folder.mkdir(parents=True, exist_ok=True)
     log_folder.mkdir(parents=True, exist_ok=True)
     csv_folder.mkdir(parents=True, exist_ok=True)
 
     # Build stem -> path maps
-    lig_map = {p.stem: p for p in lig_folder.glob("*.pdbqt")}
-    rec_map = {p.stem: p for p in prot_folder.glob("*.pdbqt")}
+    lig_map = pdbqt_stem_map(lig_folder)
+    rec_map = pdbqt_stem_map(prot_folder)
 
     print(f"[inventory] ligands: {len(lig_map)} | receptors: {len(rec_map)}")
 
@@ -226,35 +333,56 @@ if __name__ == "__main__":
     errors = 0
     timeouts = 0
 
-    for stem in common:
-        lig_path = lig_map[stem]
-        rec_path = rec_map[stem]
-        out_file = output_folder / f"{stem}_vs_{stem}.pdbqt"
+    with os.scandir(output_folder) as it:
+        done = {e.name for e in it}  # outputs from earlier runs, listed once
 
-        # Fast skip before entering the function (mirrors the inner check)
-        if out_file.exists():
-            print(f"[skip] {out_file.name} already exists, skipping.")
+    stuck = []  # (prefix, "timeout"/"error"), written once when the run ends
+    tasks = []
+    for stem in common:
+        out_name = f"{stem}.pdbqt"  # same name run_docking_pair writes
+        if out_name in done:
+            print(f"[skip] {out_name} already exists, skipping.")
             continue
 
-        before_count = len(list(csv_folder.glob(f"{stem}_vs_{stem}.csv")))
-        # Run
-        run_docking_pair(lig_path, rec_path)
-
-        # Count outcomes by checking stuck log growth or CSV
-        # (Optional) simple heuristic accounting:
-        if stuck_log_path.exists():
-            # if the stem appears in stuck log, classify timeout/error
-            with open(stuck_log_path, "r", encoding="utf-8") as sl:
-                lines = [ln for ln in sl if ln.startswith(f"{stem}_vs_{stem}\t")]
-            for ln in lines:
-                if "\ttimeout" in ln:
+        tasks.append((lig_map[stem], rec_map[stem]))
+
+    # Box every receptor up front, here in the parent so new auto boxes land in
+    # AUTO_BOX_CACHE; threads overlap the (often cold-cache) receptor reads
+    with ThreadPoolExecutor(max_workers=max(1, min(BOX_IO_WORKERS, len(tasks)))) as ex:
+        boxes = list(ex.map(build_box_for_receptor, [rec_path for _, rec_path in tasks]))
+    tasks = [(lig_path, rec_path, center, size) for (lig_path, rec_path), (center, size) in zip(tasks, boxes)]
+
+    # Run: MAX_WORKERS Vina processes at a time, VINA_CPU_PER_JOB cores each
+    print(f"[plan] {len(tasks)} dockings on {MAX_WORKERS} worker(s) x {VINA_CPU_PER_JOB} cpu")
+    pool_kwargs = {}
+    core_sets = worker_core_sets()
+    if core_sets:
+        free_cores = multiprocessing.Queue()
+        for cores in core_sets:
+            free_cores.put(cores)
+        pool_kwargs = dict(initializer=_pin_worker, initargs=(free_cores,))
+        print(f"[plan] pinning workers to cores: {[sorted(c) for c in core_sets]}")
+    try:
+        with ProcessPoolExecutor(max_workers=MAX_WORKERS, **pool_kwargs) as ex:
+            futures = {ex.submit(run_docking_pair, *task): task[0].stem for task in tasks}
+            for fut in as_completed(futures):
+                try:
+                    outcome = fut.result()
+                except Exception as e:
+                    print(f"[error] {futures[fut]}: {e}")
+                    outcome = "error"
+                # Count outcomes from what each pair reports
+                if outcome == "ok":
+                    processed += 1
+                elif outcome == "timeout":
                     timeouts += 1
-                elif "\terror" in ln:
+                    stuck.append((futures[fut], "timeout"))
+                elif outcome == "error":
                     errors += 1
-
-        after_count = len(list(csv_folder.glob(f"{stem}_vs_{stem}.csv")))
-        if after_count > before_count:
-            processed += 1
+                    stuck.append((futures[fut], "error"))
+    finally:
+        # Also on Ctrl-C, so the pairs that already got stuck are not lost
+        append_stuck(stuck)
 
     print(f"\nDone. Processed: {processed} | Errors: {errors} | Timeouts: {timeouts}\n")
     print(f"[log] Stuck/timeout list: {stuck_log_path}")